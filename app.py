@@ -1,16 +1,70 @@
 # -*- coding: utf-8 -*-
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, g, has_request_context
 import pandas as pd
 import re
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import io
 import os
 import json
+import math
+import random
+import cProfile
+import pstats
+import sys
+import threading
+import functools
+import hashlib
+try:
+    import fcntl
+except ImportError:  # Windows: sem limite de concorrência entre processos
+    fcntl = None
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
 
+# Modo de serviço assíncrono: com SERVING_MODE=gevent o gunicorn usa workers
+# gevent (ver gunicorn.conf.py) e o gRPC do Firestore precisa cooperar com o
+# loop do gevent antes de o cliente ser criado.
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+if SERVING_MODE == 'gevent':
+    from grpc.experimental import gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+# Quantas leituras do Firestore uma requisição pode fazer ao mesmo tempo
+READ_CONCURRENCY = int(os.environ.get('READ_CONCURRENCY', '8'))
+
+# Limites das rotas de ingestão (upload, anexação e gravação). Um pedido
+# grande demais recebe 413; com a ingestão saturada, 429 + Retry-After. As
+# vagas valem para a máquina inteira (todos os workers do gunicorn): com
+# workers sync, as consultas só mantêm workers livres durante cargas em massa
+# se workers x threads for maior que INGEST_CONCURRENCY + INGEST_QUEUE_SIZE,
+# já que quem espera na fila também ocupa uma thread. O gunicorn.conf.py
+# distribuído usa 2 workers x 4 threads e avisa se os limites passarem disso.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+MAX_JSON_BYTES = int(os.environ.get('MAX_JSON_BYTES', str(20 * 1024 * 1024)))
+MAX_RECORDS_PER_REQUEST = int(os.environ.get('MAX_RECORDS_PER_REQUEST', '300000'))
+INGEST_CONCURRENCY = int(os.environ.get('INGEST_CONCURRENCY', '2'))
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', '4'))
+INGEST_QUEUE_TIMEOUT = float(os.environ.get('INGEST_QUEUE_TIMEOUT', '10'))
+INGEST_RETRY_AFTER = int(os.environ.get('INGEST_RETRY_AFTER', '30'))
+INGEST_LOCK_DIR = os.environ.get('INGEST_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'analisetrafego_ingest'))
+
+# Profiling opcional de requisições reais da API. Ativado por amostragem
+# (PROFILE_SAMPLE_RATE, de 0 a 1) ou pelo cabeçalho X-Profile-Request com o
+# valor de PROFILE_TOKEN. Os resultados vão para PROFILE_DIR, que guarda só
+# os PROFILE_MAX_FILES perfis mais recentes.
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'analisetrafego_profiles'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = max(MAX_UPLOAD_BYTES, MAX_JSON_BYTES)
 db = None
 try:
     creds_json_str = os.environ.get('FIREBASE_CREDENTIALS_JSON')
@@ -26,26 +80,104 @@ except Exception as e:
     print(f"ERRO: Falha ao inicializar o Firebase Admin SDK: {e}")
 
 
-def parse_data_file(file_content):
+# Tabela de aeródromos atendidos. Cada aeródromo tem o prefixo do cabeçalho
+# dos seus arquivos, as cabeceiras de pista válidas e a coleção do Firestore
+# onde seus uploads ficam (uma partição por ICAO). O SBIZ mantém a coleção
+# original 'flight_uploads'.
+DEFAULT_ICAO = 'SBIZ'
+AERODROMES = {
+    'SBIZ': {'header_prefix': 'SBIZAIZ0', 'runways': ('07', '25'), 'collection': 'flight_uploads'},
+}
+for _icao, _config in AERODROMES.items():
+    _config.setdefault('collection', f'flight_uploads_{_icao}')
+    _config['runway_re'] = re.compile(r'\s(' + '|'.join(map(re.escape, _config['runways'])) + r')$')
+
+
+def resolve_icao(value):
+    """Normaliza o código ICAO recebido; retorna None se não estiver na tabela."""
+    icao_code = (value or DEFAULT_ICAO).strip().upper()
+    return icao_code if icao_code in AERODROMES else None
+
+
+def uploads_collection(icao_code):
+    """Coleção de uploads da partição do aeródromo."""
+    return db.collection(AERODROMES[icao_code]['collection'])
+
+
+# Campos de um registro de voo, na ordem em que são serializados para JSON.
+RECORD_FIELDS = (
+    'timestamp', 'matricula', 'tipo_aeronave', 'origem', 'destino',
+    'regra_voo', 'pista', 'responsavel', 'flight_class'
+)
+
+# Padrões compilados uma única vez, em vez de a cada linha do arquivo.
+LINE_PATTERNS = [
+    re.compile(r'^(?P<matricula>(?:AZU|GLO|TAM)\d{4})(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)'),
+    re.compile(r'^(?P<matricula>FAB\d+)(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)'),
+    re.compile(r'^(?P<matricula>N[A-Z0-9]+)(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)'),
+    re.compile(r'^(?P<matricula>\S+)\s+(?P<tipo>[A-Z0-9]+)\s+(?P<classe>[GSNM])\s+(?P<resto>.*)'),
+    re.compile(r'^(?P<matricula>\S+)\s+(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)'),
+]
+SKIP_LINE_RE = re.compile(r'\s+(MG|V)\s+\d{4}\s*$')
+OPERATOR_RE = re.compile(r'\s([A-Z]{4})$')
+RULE_RE = re.compile(r'(IV|VV)')
+OVERFLIGHT_RE = re.compile(r'([A-Z0-9]{4}).*?(\d{4}).*?([A-Z0-9]{4})')
+SINGLE_MOVE_RE = re.compile(r'([A-Z0-9]{4}).*?(\d{4})')
+TIME_ONLY_RE = re.compile(r'(\d{4})')
+
+
+class FlightRecord:
+    """Registro de voo compacto (sem __dict__); vira dict apenas na saída JSON."""
+    __slots__ = RECORD_FIELDS
+
+    def __init__(self):
+        self.timestamp = None
+        self.matricula = 'N/A'
+        self.tipo_aeronave = 'N/A'
+        self.origem = 'N/A'
+        self.destino = 'N/A'
+        self.regra_voo = 'N/A'
+        self.pista = ''
+        self.responsavel = 'N/A'
+        self.flight_class = 'N/A'
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in RECORD_FIELDS}
+
+    # Leitura como dict, para o build_report funcionar sem converter os registros
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+
+def records_to_dicts(records):
+    """Converte registros (FlightRecord ou dict) para dicts serializáveis."""
+    return [rec.to_dict() if isinstance(rec, FlightRecord) else rec for rec in records]
+
+
+def parse_data_file(file_content, icao_code=DEFAULT_ICAO):
     lines = file_content.split('\n')
     records = []
-    icao_code = 'SBIZ'
+    aerodrome = AERODROMES[icao_code]
+    header_prefix = aerodrome['header_prefix']
+    runway_re = aerodrome['runway_re']
     data_date_from_file = None
+    # Códigos ICAO e tipos de aeronave se repetem muito; sys.intern faz todos
+    # os registros compartilharem a mesma string.
+    intern = sys.intern
 
     for line in lines:
         line = line.strip()
         
-        if not line or line.startswith('SBIZAIZ0') or len(line) < 25:
+        if not line or line.startswith(header_prefix) or len(line) < 25:
             continue
 
-        if re.search(r'\s+(MG|V)\s+\d{4}\s*$', line):
+        if SKIP_LINE_RE.search(line):
             continue
 
-        record = {
-            'timestamp': None, 'matricula': 'N/A', 'tipo_aeronave': 'N/A',
-            'origem': 'N/A', 'destino': 'N/A', 'regra_voo': 'N/A',
-            'pista': '', 'responsavel': 'N/A', 'flight_class': 'N/A'
-        }
+        record = FlightRecord()
 
         try:
             date_str_header = line[9:15]
@@ -54,16 +186,8 @@ def parse_data_file(file_content):
             route_block = ''
             
             match = None
-            patterns = [
-                r'^(?P<matricula>(?:AZU|GLO|TAM)\d{4})(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)',
-                r'^(?P<matricula>FAB\d+)(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)',
-                r'^(?P<matricula>N[A-Z0-9]+)(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)',
-                r'^(?P<matricula>\S+)\s+(?P<tipo>[A-Z0-9]+)\s+(?P<classe>[GSNM])\s+(?P<resto>.*)',
-                r'^(?P<matricula>\S+)\s+(?P<tipo_classe>[A-Z0-9]+[GSNM])\s+(?P<resto>.*)',
-            ]
-
-            for pattern in patterns:
-                match = re.match(pattern, data_block)
+            for pattern in LINE_PATTERNS:
+                match = pattern.match(data_block)
                 if match:
                     break
             
@@ -71,65 +195,65 @@ def parse_data_file(file_content):
                 print(f"AVISO: Linha não correspondeu a nenhum padrão: '{line}'")
                 continue
 
-            g = match.groupdict()
-            record['matricula'] = g['matricula']
-            route_block = g['resto'].strip()
+            groups = match.groupdict()
+            record.matricula = groups['matricula']
+            route_block = groups['resto'].strip()
             
-            if 'tipo_classe' in g:
-                type_class_str = g['tipo_classe']
-                record['tipo_aeronave'] = type_class_str[:-1]
-                record['flight_class'] = type_class_str[-1]
+            if 'tipo_classe' in groups:
+                type_class_str = groups['tipo_classe']
+                record.tipo_aeronave = intern(type_class_str[:-1])
+                record.flight_class = intern(type_class_str[-1])
             else:
-                record['tipo_aeronave'] = g['tipo']
-                record['flight_class'] = g['classe']
+                record.tipo_aeronave = intern(groups['tipo'])
+                record.flight_class = intern(groups['classe'])
 
-            op_match = re.search(r'\s([A-Z]{4})$', route_block)
+            op_match = OPERATOR_RE.search(route_block)
             if op_match:
-                record['responsavel'] = op_match.group(1)
+                record.responsavel = intern(op_match.group(1))
                 route_block = route_block[:op_match.start()].strip()
             
-            pista_match = re.search(r'\s(07|25)$', route_block)
+            pista_match = runway_re.search(route_block)
             if pista_match:
-                record['pista'] = pista_match.group(1)
+                record.pista = intern(pista_match.group(1))
                 route_block = route_block[:pista_match.start()].strip()
             
-            rule_match = re.search(r'(IV|VV)', route_block)
+            rule_match = RULE_RE.search(route_block)
             if rule_match:
-                record['regra_voo'] = 'IFR' if rule_match.group(1) == 'IV' else 'VFR'
+                record.regra_voo = 'IFR' if rule_match.group(1) == 'IV' else 'VFR'
             
             horario_str = ''
             waypoints = []
             
-            overflight_match = re.search(r'([A-Z0-9]{4}).*?(\d{4}).*?([A-Z0-9]{4})', route_block)
+            overflight_match = OVERFLIGHT_RE.search(route_block)
             if overflight_match:
-                waypoints.append(overflight_match.group(1))
+                waypoints.append(intern(overflight_match.group(1)))
                 horario_str = overflight_match.group(2)
-                waypoints.append(overflight_match.group(3))
+                waypoints.append(intern(overflight_match.group(3)))
             else:
-                single_move_match = re.search(r'([A-Z0-9]{4}).*?(\d{4})', route_block)
+                single_move_match = SINGLE_MOVE_RE.search(route_block)
                 if single_move_match:
-                    waypoints.append(single_move_match.group(1))
+                    waypoints.append(intern(single_move_match.group(1)))
                     horario_str = single_move_match.group(2)
                 else:
-                    time_only_match = re.search(r'(\d{4})', route_block)
+                    time_only_match = TIME_ONLY_RE.search(route_block)
                     if time_only_match:
                         horario_str = time_only_match.group(1)
 
             if len(waypoints) >= 2:
-                record['destino'] = waypoints[0]
-                record['origem'] = waypoints[1]
+                record.destino = waypoints[0]
+                record.origem = waypoints[1]
             elif len(waypoints) == 1:
-                record['origem'] = icao_code
-                record['destino'] = waypoints[0]
+                record.origem = icao_code
+                record.destino = waypoints[0]
             else:
-                record['origem'] = icao_code
-                record['destino'] = icao_code
+                record.origem = icao_code
+                record.destino = icao_code
             
             if horario_str:
                 dt_obj = datetime.strptime(f"{date_str_header}{horario_str}", '%d%m%y%H%M')
-                record['timestamp'] = dt_obj.isoformat() + 'Z'
+                record.timestamp = dt_obj.isoformat() + 'Z'
                 if data_date_from_file is None:
-                    data_date_from_file = record['timestamp']
+                    data_date_from_file = record.timestamp
             
             records.append(record)
 
@@ -139,20 +263,647 @@ def parse_data_file(file_content):
     return {"records": records, "icao_code": icao_code, "data_date": data_date_from_file}
 
 
+def compute_daily_counts(records):
+    """Rollup de registros por dia (AAAA-MM-DD) usado nos documentos de upload."""
+    daily_counts = {}
+    for rec in records:
+        timestamp = rec.timestamp if isinstance(rec, FlightRecord) else rec.get('timestamp')
+        if timestamp:
+            day = timestamp[:10]
+            daily_counts[day] = daily_counts.get(day, 0) + 1
+    return daily_counts
+
+
+def last_timestamp_of(records, current=None):
+    """Maior timestamp entre os registros (ISO ordena como texto)."""
+    for rec in records:
+        timestamp = rec.timestamp if isinstance(rec, FlightRecord) else rec.get('timestamp')
+        if timestamp and (current is None or timestamp > current):
+            current = timestamp
+    return current
+
+
+def write_records(upload_ref, records, doc_ids=None):
+    """Grava os registros na subcoleção 'records' do upload em lotes de 500.
+
+    Com doc_ids, cada registro usa o ID indicado (gravar de novo sobrescreve).
+    """
+    batch = db.batch()
+    for i, rec in enumerate(records):
+        doc_ref = upload_ref.collection('records').document(doc_ids[i] if doc_ids else None)
+        batch.set(doc_ref, rec)
+        if (i + 1) % 500 == 0: # Commits a cada 500 registros
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+
+
+# vvvvvv ÍNDICE RESUMIDO DE UPLOADS POR USUÁRIO vvvvvv
+# Um documento por usuário e aeródromo com o resumo de todos os uploads,
+# mantido por save_records, append_upload e delete_upload. O histórico é
+# servido com uma única leitura, sem consultar a coleção de uploads. Usuários
+# anteriores ao índice têm o documento reconstruído (numa transação) antes da
+# primeira alteração ou leitura, para que uploads antigos não sumam.
+HISTORY_PAGE_SIZE = 50
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def upload_index_ref(user_id, icao_code):
+    return db.collection('upload_index').document(f'{icao_code}_{user_id}')
+
+
+def index_upload(user_id, icao_code, upload_id, fields):
+    """Cria ou atualiza (merge) o resumo de um upload no índice do usuário."""
+    ensure_upload_index(user_id, icao_code)
+    upload_index_ref(user_id, icao_code).set({
+        'userId': user_id, 'icaoCode': icao_code, 'updatedAt': firestore.SERVER_TIMESTAMP,
+        'uploads': {upload_id: fields}
+    }, merge=True)
+
+
+def unindex_upload(user_id, icao_code, upload_id):
+    ensure_upload_index(user_id, icao_code)
+    upload_index_ref(user_id, icao_code).update({
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+        firestore.Client.field_path('uploads', upload_id): firestore.DELETE_FIELD
+    })
+
+
+@firestore.transactional
+def rebuild_upload_index(transaction, user_id, icao_code):
+    """Monta o índice a partir da coleção de uploads, se ele ainda não existir.
+
+    Chamadas concorrentes não se sobrepõem: a transação repete a leitura e
+    só a primeira grava o documento.
+    """
+    index_ref = upload_index_ref(user_id, icao_code)
+    if index_ref.get(transaction=transaction).exists:
+        return
+    query = uploads_collection(icao_code).where('userId', '==', user_id)
+    uploads = {}
+    for doc in query.stream(transaction=transaction):
+        doc_data = doc.to_dict()
+        uploads[doc.id] = {
+            'createdAt': doc_data.get('createdAt'), 'recordCount': doc_data.get('recordCount'),
+            'icaoCode': doc_data.get('icaoCode', None), 'dataDate': doc_data.get('dataDate', None)
+        }
+    transaction.set(index_ref, {
+        'userId': user_id, 'icaoCode': icao_code, 'updatedAt': firestore.SERVER_TIMESTAMP,
+        'uploads': uploads
+    })
+
+
+def ensure_upload_index(user_id, icao_code):
+    rebuild_upload_index(db.transaction(), user_id, icao_code)
+# ^^^^^^ FIM DO ÍNDICE RESUMIDO ^^^^^^
+
+
+# vvvvvv ÁREA DE STAGING DOS UPLOADS vvvvvv
+# O resultado do parse fica no servidor, em disco local (compartilhado entre
+# os workers do gunicorn), sob um staging ID. O navegador recebe só uma
+# prévia e, para salvar, envia apenas o ID. Arquivos expiram após
+# STAGING_TTL_SECONDS e o total em disco é limitado a STAGING_MAX_BYTES
+# (os mais antigos são descartados primeiro).
+STAGING_DIR = os.environ.get('STAGING_DIR', os.path.join(tempfile.gettempdir(), 'analisetrafego_staging'))
+STAGING_TTL_SECONDS = int(os.environ.get('STAGING_TTL_SECONDS', '1800'))
+STAGING_MAX_BYTES = int(os.environ.get('STAGING_MAX_BYTES', str(512 * 1024 * 1024)))
+STAGING_PREVIEW_SIZE = int(os.environ.get('STAGING_PREVIEW_SIZE', '200'))
+STAGING_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def staging_path(staging_id):
+    return os.path.join(STAGING_DIR, f'{staging_id}.json')
+
+
+def prune_staging():
+    """Remove arquivos expirados e, se preciso, os mais antigos até caber no limite."""
+    if not os.path.isdir(STAGING_DIR):
+        return
+    now = time.time()
+    entries = []
+    for name in os.listdir(STAGING_DIR):
+        path = os.path.join(STAGING_DIR, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - stat.st_mtime > STAGING_TTL_SECONDS:
+            remove_staged_file(path)
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= STAGING_MAX_BYTES:
+            break
+        remove_staged_file(path)
+        total_bytes -= size
+
+
+def remove_staged_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def staged_json_chunks(user_id, grouped_records):
+    """JSON do staging em pedaços, convertendo um FlightRecord por vez.
+
+    Evita manter a lista de registros e a lista de dicts ao mesmo tempo.
+    """
+    yield '{"userId": %s, "groups": [' % json.dumps(user_id)
+    for i, group in enumerate(grouped_records):
+        yield ', {' if i else '{'
+        for key, value in group.items():
+            if key != 'records':
+                yield f'{json.dumps(key)}: {json.dumps(value)}, '
+        yield '"records": ['
+        for j, rec in enumerate(group['records']):
+            yield (', ' if j else '') + json.dumps(rec.to_dict() if isinstance(rec, FlightRecord) else rec)
+        yield ']}'
+    yield ']}'
+
+
+def stage_upload(user_id, grouped_records):
+    """Guarda os grupos parseados e devolve o staging ID."""
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    staging_id = uuid.uuid4().hex
+    tmp_path = staging_path(staging_id) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(staged_json_chunks(user_id, grouped_records))
+    os.replace(tmp_path, staging_path(staging_id))
+    prune_staging()
+    return staging_id
+
+
+def load_staged_upload(staging_id):
+    """Lê o staging; retorna None se o ID for inválido, expirado ou descartado."""
+    if not isinstance(staging_id, str) or not STAGING_ID_RE.match(staging_id):
+        return None
+    path = staging_path(staging_id)
+    try:
+        if time.time() - os.path.getmtime(path) > STAGING_TTL_SECONDS:
+            remove_staged_file(path)
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def discard_staged_upload(staging_id):
+    remove_staged_file(staging_path(staging_id))
+# ^^^^^^ FIM DA ÁREA DE STAGING ^^^^^^
+
+
+# vvvvvv LIMITES E CONTROLE DE CONCORRÊNCIA DA INGESTÃO vvvvvv
+# Cada vaga é um arquivo em INGEST_LOCK_DIR travado com flock, como o staging
+# usa o disco para ser visto por todos os workers. O sistema solta a trava
+# quando o arquivo é fechado, inclusive se o worker morrer no meio da carga.
+INGEST_POLL_SECONDS = 0.1
+
+
+def try_lock_slot(kind, count):
+    """Trava uma das vagas livres do tipo; devolve o arquivo aberto ou None."""
+    os.makedirs(INGEST_LOCK_DIR, exist_ok=True)
+    for i in range(count):
+        slot_file = open(os.path.join(INGEST_LOCK_DIR, f'{kind}_{i}.lock'), 'a')
+        try:
+            fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot_file
+        except BlockingIOError:
+            slot_file.close()
+    return None
+
+
+def acquire_ingest_slot():
+    """Vaga de execução, esperando numa vaga da fila se preciso; None se lotado."""
+    slot = try_lock_slot('slot', INGEST_CONCURRENCY)
+    if slot:
+        return slot
+    queue_slot = try_lock_slot('queue', INGEST_QUEUE_SIZE)
+    if not queue_slot:
+        return None
+    try:
+        deadline = time.monotonic() + INGEST_QUEUE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(INGEST_POLL_SECONDS)
+            slot = try_lock_slot('slot', INGEST_CONCURRENCY)
+            if slot:
+                return slot
+        return None
+    finally:
+        queue_slot.close()
+
+
+def ingestion_busy():
+    response = jsonify({"error": "Servidor ocupado com outras cargas de dados. Tente novamente em instantes."})
+    response.headers['Retry-After'] = str(INGEST_RETRY_AFTER)
+    return response, 429
+
+
+def too_many_records():
+    return jsonify({"error": f"Limite de {MAX_RECORDS_PER_REQUEST} registros por requisição excedido."}), 413
+
+
+def ingestion_limited(max_bytes):
+    """Limita o tamanho do corpo e a concorrência das rotas de ingestão.
+
+    Até INGEST_CONCURRENCY requisições executam ao mesmo tempo, somando todos
+    os workers; até INGEST_QUEUE_SIZE esperam na fila por no máximo
+    INGEST_QUEUE_TIMEOUT segundos. O restante recebe 429 imediatamente.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.content_length is not None and request.content_length > max_bytes:
+                return jsonify({"error": f"Requisição maior que o limite de {max_bytes // (1024 * 1024)} MB."}), 413
+            if fcntl is None:
+                return view(*args, **kwargs)
+            slot = acquire_ingest_slot()
+            if not slot:
+                return ingestion_busy()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                slot.close()
+        return wrapper
+    return decorator
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": "Requisição maior que o limite permitido."}), 413
+# ^^^^^^ FIM DOS LIMITES DA INGESTÃO ^^^^^^
+
+
+def period_bounds(start_date_str, end_date_str):
+    """Converte as datas AAAA-MM-DD do período nos limites ISO usados em dataDate."""
+    start_date = datetime.fromisoformat(start_date_str + 'T00:00:00')
+    end_date = datetime.fromisoformat(end_date_str + 'T23:59:59')
+    return start_date.isoformat() + 'Z', end_date.isoformat() + 'Z'
+
+
+def load_records_in_period(user_id, icao_code, start_iso, end_iso):
+    """Registros de todos os uploads do usuário cujo dataDate está no período."""
+    uploads_ref = uploads_collection(icao_code)
+    query = uploads_ref.where('userId', '==', user_id).where('dataDate', '>=', start_iso).where('dataDate', '<=', end_iso)
+
+    relevant_uploads = [doc.id for doc in query.stream()]
+    all_records = []
+    records_per_upload = fetch_in_parallel(
+        lambda upload_id: stream_collection(uploads_ref.document(upload_id).collection('records')),
+        relevant_uploads
+    )
+    for records in records_per_upload:
+        all_records.extend(records)
+    return all_records
+
+
+# vvvvvv SNAPSHOT DO RELATÓRIO vvvvvv
+# O relatório de um período (estatísticas, gráficos, anomalias e projeção) é
+# calculado uma vez e guardado em 'report_snapshots'. Abrir ou imprimir o
+# relatório de novo custa uma leitura; save, append e delete apagam os
+# snapshots cujo período contém o dataDate do upload alterado. Como essas
+# rotas atualizam o 'updatedAt' do índice de uploads antes de apagar os
+# snapshots, ele serve de geração: o snapshot só é gravado se não mudou
+# desde antes da leitura dos registros.
+COMMERCIAL_PREFIXES = ('AZU', 'GLO', 'TAM')
+ANOMALY_THRESHOLD = 1.5
+PROJECTION_MONTHS = 3
+
+
+def report_snapshot_ref(user_id, icao_code, start_date_str, end_date_str):
+    return db.collection('report_snapshots').document(f'{icao_code}_{user_id}_{start_date_str}_{end_date_str}')
+
+
+@firestore.transactional
+def store_report_snapshot(transaction, snapshot_ref, index_ref, generation, snapshot):
+    """Grava o snapshot se a geração do índice ainda é a lida antes dos registros."""
+    index_doc = index_ref.get(transaction=transaction)
+    current = index_doc.to_dict().get('updatedAt') if index_doc.exists else None
+    if current != generation:
+        return False
+    transaction.set(snapshot_ref, snapshot)
+    return True
+
+
+def invalidate_report_snapshots(user_id, icao_code, data_date):
+    """Apaga os snapshots do usuário cujo período inclui data_date."""
+    if not data_date:
+        return
+    query = db.collection('report_snapshots').where('userId', '==', user_id).where('icaoCode', '==', icao_code)
+    for doc in query.stream():
+        snapshot = doc.to_dict()
+        if snapshot['startDate'] <= data_date <= snapshot['endDate']:
+            doc.reference.delete()
+
+
+def count_by(records, key_func):
+    counts = {}
+    for rec in records:
+        key = key_func(rec)
+        if key is not None:
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def top_items(counts, limit):
+    return [[item, count] for item, count in sorted(counts.items(), key=lambda entry: -entry[1])[:limit]]
+
+
+def project_traffic(monthly_counts):
+    """Regressão linear sobre os totais mensais, projetada para os próximos meses."""
+    values = [monthly_counts[month] for month in sorted(monthly_counts)]
+    n = len(values)
+    if n < 2:
+        return []
+    sum_x, sum_y = sum(range(n)), sum(values)
+    sum_xy = sum(x * y for x, y in enumerate(values))
+    sum_xx = sum(x * x for x in range(n))
+    slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x * sum_x)
+    intercept = sum_y / n - slope * sum_x / n
+    projection = []
+    for i in range(PROJECTION_MONTHS):
+        value = slope * (n + i) + intercept
+        projection.append(math.floor(value + 0.5) if value > 0 else 0)
+    return projection
+
+
+def detect_anomalies(records, daily_counts):
+    """Dias com volume fora de média ± 1,5 desvio padrão (mesma regra do painel)."""
+    if len(records) < 7:
+        return {'status': 'insufficient', 'items': []}
+    counts = list(daily_counts.values())
+    if len(counts) < 2:
+        return {'status': 'short', 'items': []}
+    mean = sum(counts) / len(counts)
+    std_dev = math.sqrt(sum((c - mean) ** 2 for c in counts) / len(counts))
+    items = []
+    for day in sorted(daily_counts):
+        count = daily_counts[day]
+        if count > mean + ANOMALY_THRESHOLD * std_dev:
+            items.append({'day': day, 'count': count, 'type': 'alto'})
+        elif count < mean - ANOMALY_THRESHOLD * std_dev:
+            items.append({'day': day, 'count': count, 'type': 'baixo'})
+    return {'status': 'ok', 'mean': mean, 'items': items}
+
+
+def build_report(records, icao_code):
+    """Agregados do painel (renderStats, gráficos e anomalias) para os registros."""
+    timestamps = [rec['timestamp'] for rec in records if rec.get('timestamp')]
+    hourly_counts = [0] * 24
+    day_of_week_counts = [0] * 7
+    month_counts = [0] * 12
+    for timestamp in timestamps:
+        hourly_counts[int(timestamp[11:13])] += 1
+        # weekday() começa na segunda; o painel usa domingo = 0
+        day_of_week_counts[(datetime.fromisoformat(timestamp[:19]).weekday() + 1) % 7] += 1
+        month_counts[int(timestamp[5:7]) - 1] += 1
+
+    peak_hours = []
+    if timestamps:
+        peak = max(hourly_counts)
+        peak_hours = [str(hour) for hour, count in enumerate(hourly_counts) if count == peak]
+
+    dest_counts = count_by(records, lambda rec: rec.get('destino') or 'N/A')
+    dest_counts.pop(icao_code, None)
+    type_counts = count_by(records, lambda rec: rec.get('tipo_aeronave') or 'N/A')
+    type_counts.pop('N/A', None)
+    operator_counts = count_by(records, lambda rec: rec.get('responsavel') or 'N/A')
+    operator_counts.pop('N/A', None)
+    monthly_counts = count_by(records, lambda rec: rec['timestamp'][:7] if rec.get('timestamp') else None)
+    daily_counts = count_by(records, lambda rec: rec['timestamp'][:10] if rec.get('timestamp') else None)
+
+    return {
+        'stats': {
+            'totalVoos': len(records),
+            'voosComerciais': sum(1 for rec in records if (rec.get('matricula') or '').startswith(COMMERCIAL_PREFIXES)),
+            'sobrevoos': sum(1 for rec in records if rec.get('origem') != icao_code and rec.get('destino') != icao_code),
+            'horarioPico': ', '.join(peak_hours) + 'h' if peak_hours else '-',
+        },
+        'ruleCounts': count_by(records, lambda rec: rec.get('regra_voo') or 'N/A'),
+        'destCounts': dest_counts,
+        'hourlyCounts': hourly_counts,
+        'dayOfWeekCounts': day_of_week_counts,
+        'monthCounts': month_counts,
+        'runwayCounts': count_by(records, lambda rec: rec['pista'] if (rec.get('pista') or '').strip() not in ('', 'N/A') else None),
+        'topAircraftTypes': top_items(type_counts, 5),
+        'topOperators': top_items(operator_counts, 5),
+        'monthlyCounts': monthly_counts,
+        'projection': project_traffic(monthly_counts),
+        'anomalies': detect_anomalies(records, daily_counts),
+    }
+# ^^^^^^ FIM DO SNAPSHOT DO RELATÓRIO ^^^^^^
+
+
+def stream_collection(coll_ref):
+    with firestore_wait():
+        return [doc.to_dict() for doc in coll_ref.stream()]
+
+
+def fetch_in_parallel(func, items):
+    """Executa leituras independentes ao mesmo tempo, preservando a ordem.
+
+    Em workers gevent as threads são greenlets, então cada worker atende
+    outras requisições enquanto espera a rede.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    if getattr(g, 'profiler', None):
+        func = profiled_in_thread(func, g.thread_profiles)
+    with firestore_wait(), ThreadPoolExecutor(max_workers=min(READ_CONCURRENCY, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+# vvvvvv PROFILING OPCIONAL DE REQUISIÇÕES vvvvvv
+# Cada requisição amostrada roda sob cProfile. São gravados dois arquivos em
+# PROFILE_DIR: o .prof (pstats; vira flamegraph com 'flameprof arquivo.prof'
+# ou 'snakeviz arquivo.prof') e um .json com rota, status, duração,
+# quantidade de registros e tempo gasto dentro do cliente do Firestore.
+#
+# O cProfile mede a thread do sistema em que foi ativado, então só uma
+# requisição por processo é perfilada de cada vez; as outras seguem sem
+# profiling. No modo gevent todas as requisições do worker dividem a mesma
+# thread e o cProfile misturaria os greenlets: lá cada requisição amostrada
+# é só cronometrada (tempo de relógio), sem .prof. O .json traz então
+# firestoreWaitSeconds, o tempo de relógio esperando as leituras de
+# registros (stream_collection e fetch_in_parallel), no lugar de
+# firestoreSeconds.
+_profile_lock = threading.Lock()
+
+
+def should_profile():
+    if not request.path.startswith('/api/'):
+        return False
+    if PROFILE_TOKEN and request.headers.get('X-Profile-Request') == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def profiled_in_thread(func, thread_profiles):
+    """Perfila também as leituras feitas nas threads de fetch_in_parallel."""
+    def wrapper(item):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+: só um profiler ativo por vez no interpretador
+            return func(item)
+        try:
+            return func(item)
+        finally:
+            profiler.disable()
+            thread_profiles.append(profiler)
+    return wrapper
+
+
+@contextmanager
+def firestore_wait():
+    """Soma ao cronômetro da requisição (modo gevent) o tempo esperando o Firestore."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Threads de fetch_in_parallel não têm contexto de requisição; o tempo
+        # delas já entra pela espera da própria fetch_in_parallel
+        if has_request_context() and getattr(g, 'timing', False):
+            g.firestore_wait += time.perf_counter() - started
+
+
+def note_record_count(count):
+    """Registra quantos registros a requisição processou (metadado do profiling)."""
+    g.record_count = count
+
+
+def firestore_seconds(stats):
+    """Tempo acumulado nas funções do Firestore chamadas pelo código do app.
+
+    Soma o tempo de cada entrada no pacote do Firestore a partir de código de
+    fora dele; com leituras paralelas, é a soma entre as threads.
+    """
+    def in_firestore(func):
+        return 'google/cloud/firestore' in func[0].replace(os.sep, '/')
+
+    total = 0.0
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        if not in_firestore(func):
+            continue
+        for caller, caller_stats in callers.items():
+            if not in_firestore(caller):
+                total += caller_stats[3]
+    return total
+
+
+def prune_profiles():
+    """Apaga os perfis mais antigos além de PROFILE_MAX_FILES (.json + .prof, se houver)."""
+    entries = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith('.json'):
+            continue
+        base_name = os.path.join(PROFILE_DIR, name[:-len('.json')])
+        try:
+            entries.append((os.path.getmtime(base_name + '.json'), base_name))
+        except FileNotFoundError:
+            continue
+    for _, base_name in sorted(entries)[:max(len(entries) - PROFILE_MAX_FILES, 0)]:
+        for path in (base_name + '.json', base_name + '.prof'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+@app.before_request
+def start_profiling():
+    if not should_profile():
+        return
+    if SERVING_MODE == 'gevent':
+        g.timing = True
+        g.firestore_wait = 0.0
+        g.profile_started = time.perf_counter()
+    elif _profile_lock.acquire(blocking=False):
+        g.profiling = True
+        g.thread_profiles = []
+        g.profile_started = time.perf_counter()
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def finish_profiling(response):
+    profiler = getattr(g, 'profiler', None)
+    timing = getattr(g, 'timing', False)
+    if not profiler and not timing:
+        return response
+    if profiler:
+        profiler.disable()
+        g.profiler = None
+    g.timing = False
+    try:
+        elapsed = time.perf_counter() - g.profile_started
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        route = request.url_rule.rule if request.url_rule else request.path
+        route_slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')
+        base_name = os.path.join(PROFILE_DIR, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}_{route_slug}_{uuid.uuid4().hex[:8]}")
+        summary = {
+            'route': route, 'path': request.full_path, 'method': request.method,
+            'status': response.status_code, 'durationSeconds': elapsed,
+            'recordCount': getattr(g, 'record_count', None),
+        }
+        if profiler:
+            stats = pstats.Stats(profiler)
+            for thread_profiler in g.thread_profiles:
+                stats.add(thread_profiler)
+            stats.dump_stats(base_name + '.prof')
+            summary['firestoreSeconds'] = firestore_seconds(stats)
+            summary['parallelThreads'] = len(g.thread_profiles)
+            saved = base_name + '.prof'
+        else:
+            summary['firestoreWaitSeconds'] = g.firestore_wait
+            saved = base_name + '.json'
+        with open(base_name + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        prune_profiles()
+        print(f"Profiling de {request.method} {route} salvo em {saved} ({elapsed:.3f}s)")
+    except Exception as e:
+        print(f"ERRO ao salvar profiling: {e}")
+    return response
+
+
+@app.teardown_request
+def stop_profiling(exc):
+    # Garante que o profiler não fique ativo se a view levantar exceção
+    profiler = getattr(g, 'profiler', None)
+    if profiler:
+        profiler.disable()
+    if getattr(g, 'profiling', False):
+        g.profiling = False
+        _profile_lock.release()
+# ^^^^^^ FIM DO PROFILING OPCIONAL ^^^^^^
+
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', aerodromes=sorted(AERODROMES), default_icao=DEFAULT_ICAO)
 
 # vvvvvv ROTA DE UPLOAD ATUALIZADA PARA SEPARAR ARQUIVOS vvvvvv
 @app.route('/api/upload', methods=['POST'])
+@ingestion_limited(MAX_UPLOAD_BYTES)
 def upload_file():
+    user_id = None
     try:
         auth_header = request.headers.get('Authorization')
         id_token = auth_header.split(' ').pop()
         decoded_token = auth.verify_id_token(id_token)
-        print(f"Upload autorizado para o usuário: {decoded_token['uid']}")
+        user_id = decoded_token['uid']
+        print(f"Upload autorizado para o usuário: {user_id}")
     except Exception as e:
         return jsonify({"error": "Token inválido ou expirado"}), 401
+    icao_code = resolve_icao(request.form.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
     
     files = request.files.getlist('dataFiles')
 
@@ -161,13 +912,19 @@ def upload_file():
 
     # Em vez de uma lista única, criaremos uma lista de grupos de registros
     grouped_records = []
+    total_records = 0
 
     for file in files:
         if file.filename != '':
             try:
-                content = io.StringIO(file.stream.read().decode("utf-8", errors='ignore')).getvalue()
-                parsed_data = parse_data_file(content)
+                raw_content = file.stream.read()
+                content = io.StringIO(raw_content.decode("utf-8", errors='ignore')).getvalue()
+                parsed_data = parse_data_file(content, icao_code)
                 
+                total_records += len(parsed_data["records"])
+                if total_records > MAX_RECORDS_PER_REQUEST:
+                    return too_many_records()
+
                 # Adiciona o grupo de registros do arquivo à lista principal
                 if parsed_data["records"]:
                     grouped_records.append({
@@ -183,13 +940,53 @@ def upload_file():
     if not grouped_records:
         return jsonify({"error": "Nenhum registro válido encontrado nos arquivos"}), 400
 
-    # Retorna a lista de grupos de arquivos processados
-    return jsonify({ "grouped_records": grouped_records })
+    note_record_count(total_records)
+    # Os registros completos ficam no staging; o navegador recebe só uma prévia
+    staging_id = stage_upload(user_id, grouped_records)
+    preview_groups = [{
+        "fileName": group["fileName"], "icao_code": group["icao_code"], "data_date": group["data_date"],
+        "recordCount": len(group["records"]), "records": records_to_dicts(group["records"][:STAGING_PREVIEW_SIZE])
+    } for group in grouped_records]
+    # Se a prévia não tem tudo, o painel usa os agregados de todos os registros
+    report = None
+    if any(len(group["records"]) > STAGING_PREVIEW_SIZE for group in grouped_records):
+        report = build_report([rec for group in grouped_records for rec in group["records"]], icao_code)
+    return jsonify({ "staging_id": staging_id, "grouped_records": preview_groups, "report": report })
 # ^^^^^^ FIM DA ATUALIZAÇÃO ^^^^^^
 
 
+CSV_HEADERS = ['Data/Hora', 'Matrícula', 'Tipo Aeronave', 'Tipo Voo', 'Origem', 'Destino', 'Regra', 'Pista']
+CSV_FIELDS = ('timestamp', 'matricula', 'tipo_aeronave', 'flight_class', 'origem', 'destino', 'regra_voo', 'pista')
+
+
+@app.route('/api/staged_csv/<staging_id>', methods=['GET'])
+def staged_csv(staging_id):
+    """CSV com todos os registros do staging (o navegador só tem a prévia)."""
+    user_id = None
+    try:
+        auth_header = request.headers.get('Authorization')
+        id_token = auth_header.split(' ').pop()
+        decoded_token = auth.verify_id_token(id_token)
+        user_id = decoded_token['uid']
+    except Exception as e:
+        return jsonify({"error": "Autenticação falhou"}), 401
+    staged = load_staged_upload(staging_id)
+    if staged is None:
+        return jsonify({"error": "Dados processados expiraram; envie o(s) arquivo(s) novamente."}), 410
+    if staged['userId'] != user_id:
+        return jsonify({"error": "Acesso não autorizado"}), 403
+
+    def rows():
+        yield ','.join(CSV_HEADERS) + '\n'
+        for group in staged['groups']:
+            for rec in group['records']:
+                yield ','.join(rec.get(field) or '' for field in CSV_FIELDS) + '\n'
+    return Response(rows(), mimetype='text/csv')
+
+
 # vvvvvv ROTA DE SALVAR ATUALIZADA PARA MÚLTIPLOS DOCUMENTOS vvvvvv
 @app.route('/api/save_records', methods=['POST'])
+@ingestion_limited(MAX_JSON_BYTES)
 def save_records():
     user_id = None
     try:
@@ -202,43 +999,268 @@ def save_records():
     if not db:
         return jsonify({"error": "Conexão com o banco de dados não está disponível"}), 500
     try:
-        # Agora esperamos uma lista de uploads para salvar
-        uploads_to_save = request.get_json()
+        # Preferencialmente recebemos {"staging_id": ...}; a lista completa de
+        # uploads continua aceita para clientes antigos
+        payload = request.get_json()
+        staging_id = None
+        if isinstance(payload, dict) and 'staging_id' in payload:
+            staging_id = payload['staging_id']
+            if not isinstance(staging_id, str):
+                return jsonify({"error": "staging_id inválido"}), 400
+            staged = load_staged_upload(staging_id)
+            if staged is None:
+                return jsonify({"error": "Dados processados expiraram; envie o(s) arquivo(s) novamente."}), 410
+            if staged['userId'] != user_id:
+                return jsonify({"error": "Acesso não autorizado"}), 403
+            uploads_to_save = staged['groups']
+        else:
+            uploads_to_save = payload
         if not uploads_to_save or not isinstance(uploads_to_save, list):
             return jsonify({"error": "Dados inválidos ou vazios"}), 400
+        total_records = sum(len(upload_data.get('records') or []) for upload_data in uploads_to_save)
+        note_record_count(total_records)
+        if total_records > MAX_RECORDS_PER_REQUEST:
+            return too_many_records()
 
         saved_count = 0
         # Itera sobre cada grupo de arquivo e salva como um documento separado
         for upload_data in uploads_to_save:
             records_to_save = upload_data.get('records')
-            icao_code = upload_data.get('icao_code')
+            icao_code = resolve_icao(upload_data.get('icao_code'))
             data_date = upload_data.get('data_date')
             
-            if not records_to_save:
+            if not records_to_save or not icao_code:
                 continue
 
-            upload_ref = db.collection('flight_uploads').document()
+            upload_ref = uploads_collection(icao_code).document()
             upload_ref.set({
                 'userId': user_id, 'createdAt': firestore.SERVER_TIMESTAMP,
-                'recordCount': len(records_to_save), 'icaoCode': icao_code, 'dataDate': data_date
+                'recordCount': len(records_to_save), 'icaoCode': icao_code, 'dataDate': data_date,
+                'lastTimestamp': last_timestamp_of(records_to_save),
+                'dailyCounts': compute_daily_counts(records_to_save)
             })
             
-            batch = db.batch()
-            for i, rec in enumerate(records_to_save):
-                doc_ref = upload_ref.collection('records').document()
-                batch.set(doc_ref, rec)
-                if (i + 1) % 500 == 0: # Commits a cada 500 registros
-                    batch.commit()
-                    batch = db.batch()
-            batch.commit()
+            write_records(upload_ref, records_to_save)
+            index_upload(user_id, icao_code, upload_ref.id, {
+                'createdAt': firestore.SERVER_TIMESTAMP, 'recordCount': len(records_to_save),
+                'icaoCode': icao_code, 'dataDate': data_date
+            })
+            invalidate_report_snapshots(user_id, icao_code, data_date)
             saved_count += 1
-        
+
+        if staging_id:
+            discard_staged_upload(staging_id)
         return jsonify({"success": True, "message": f"{saved_count} arquivo(s) salvo(s) com sucesso!"}), 201
     except Exception as e:
         print(f"ERRO ao salvar no Firestore: {e}")
         return jsonify({"error": f"Erro interno ao salvar os dados: {str(e)}"}), 500
 # ^^^^^^ FIM DA ATUALIZAÇÃO ^^^^^^
 
+
+# vvvvvv ROTA DE ANEXAÇÃO INCREMENTAL vvvvvv
+# O checkpoint de cada arquivo de origem fica em 'append_checkpoints' e guarda
+# o upload de destino, o 'byteOffset' logo após a última linha completa já
+# gravada e o sha1 desses bytes ('prefixSha1'). Se o começo do arquivo mudou
+# (ex.: o log recomeçou num mês novo), ou o usuário pediu para recomeçar, o
+# arquivo vira um upload novo em vez de ser anexado ao anterior.
+#
+# Só uma anexação por arquivo roda de cada vez: o checkpoint é travado numa
+# transação até 'lockedUntil' (maior que o timeout do worker, para que uma
+# trava esquecida por um worker morto expire sozinha). Os registros anexados
+# usam como ID o byte inicial da linha no arquivo, e contadores e checkpoint
+# são gravados juntos num lote: repetir uma anexação que falhou no meio
+# regrava os mesmos documentos em vez de duplicá-los.
+APPEND_LOCK_SECONDS = int(os.environ.get('APPEND_LOCK_SECONDS', '300'))
+
+
+def append_checkpoint_ref(user_id, icao_code, file_name):
+    """Checkpoint único por usuário, aeródromo e arquivo de origem."""
+    file_key = hashlib.sha1(file_name.encode('utf-8')).hexdigest()
+    return db.collection('append_checkpoints').document(f'{icao_code}_{user_id}_{file_key}')
+
+
+def delete_append_checkpoints(user_id, upload_id):
+    query = db.collection('append_checkpoints').where('userId', '==', user_id).where('uploadId', '==', upload_id)
+    for doc in query.stream():
+        doc.reference.delete()
+
+
+def content_fingerprint(raw_content, length):
+    return hashlib.sha1(raw_content[:length]).hexdigest()
+
+
+@firestore.transactional
+def lock_append_checkpoint(transaction, checkpoint_ref, user_id, icao_code, file_name):
+    """Trava o checkpoint do arquivo para esta anexação.
+
+    Devolve o checkpoint como estava ({} se ainda não existia), ou None se
+    outra anexação do mesmo arquivo está em andamento.
+    """
+    snapshot = checkpoint_ref.get(transaction=transaction)
+    checkpoint = snapshot.to_dict() if snapshot.exists else {}
+    now = datetime.now(timezone.utc)
+    if checkpoint.get('lockedUntil') and checkpoint['lockedUntil'] > now:
+        return None
+    transaction.set(checkpoint_ref, {
+        'userId': user_id, 'icaoCode': icao_code, 'sourceFile': file_name,
+        'lockedUntil': now + timedelta(seconds=APPEND_LOCK_SECONDS)
+    }, merge=True)
+    return checkpoint
+
+
+def unlock_append_checkpoint(checkpoint_ref):
+    try:
+        checkpoint_ref.update({'lockedUntil': firestore.DELETE_FIELD})
+    except Exception as e:
+        print(f"ERRO ao liberar checkpoint de anexação: {e}")
+
+
+def parse_new_lines(raw_content, start, end, icao_code):
+    """Parse das linhas completas entre start e end, com o byte inicial de cada registro."""
+    records, line_offsets, data_date = [], [], None
+    line_start = start
+    while line_start < end:
+        line_end = raw_content.index(b'\n', line_start) + 1
+        parsed_data = parse_data_file(raw_content[line_start:line_end].decode("utf-8", errors='ignore'), icao_code)
+        for rec in parsed_data["records"]:
+            records.append(rec)
+            line_offsets.append(line_start)
+        data_date = data_date or parsed_data["data_date"]
+        line_start = line_end
+    return records, line_offsets, data_date
+
+
+@app.route('/api/append_upload', methods=['POST'])
+@ingestion_limited(MAX_UPLOAD_BYTES)
+def append_upload():
+    """Anexa ao upload existente apenas as linhas novas de cada arquivo.
+
+    Só as linhas completas depois do checkpoint são parseadas; uma linha final
+    ainda sem '\\n' fica para a próxima anexação. Arquivos sem checkpoint, com
+    o começo diferente do já anexado, cujo upload foi apagado ou enviados com
+    reset_checkpoint=1 viram um upload novo.
+    """
+    user_id = None
+    try:
+        auth_header = request.headers.get('Authorization')
+        id_token = auth_header.split(' ').pop()
+        decoded_token = auth.verify_id_token(id_token)
+        user_id = decoded_token['uid']
+    except Exception as e:
+        return jsonify({"error": "Token inválido ou expirado"}), 401
+    if not db:
+        return jsonify({"error": "Conexão com o banco de dados não está disponível"}), 500
+    icao_code = resolve_icao(request.form.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
+    reset_checkpoint = request.form.get('reset_checkpoint') == '1'
+
+    files = request.files.getlist('dataFiles')
+    if not files or all(f.filename == '' for f in files):
+        return jsonify({"error": "Nenhum arquivo enviado"}), 400
+
+    try:
+        results = []
+        total_records = 0
+        for file in files:
+            if file.filename == '':
+                continue
+            raw_content = file.stream.read()
+            complete_end = raw_content.rfind(b'\n') + 1
+
+            checkpoint_ref = append_checkpoint_ref(user_id, icao_code, file.filename)
+            checkpoint = lock_append_checkpoint(db.transaction(), checkpoint_ref, user_id, icao_code, file.filename)
+            if checkpoint is None:
+                results.append({"fileName": file.filename, "error": "Outra anexação deste arquivo está em andamento; tente novamente em instantes."})
+                continue
+            try:
+                upload_doc = None
+                byte_offset = 0
+                if checkpoint.get('uploadId') and not reset_checkpoint:
+                    candidate = uploads_collection(icao_code).document(checkpoint['uploadId']).get()
+                    saved_offset = checkpoint.get('byteOffset', 0)
+                    if (candidate.exists and saved_offset <= len(raw_content)
+                            and checkpoint.get('prefixSha1') == content_fingerprint(raw_content, saved_offset)):
+                        upload_doc, byte_offset = candidate, saved_offset
+
+                new_offset = max(complete_end, byte_offset)
+                records, line_offsets, data_date = parse_new_lines(raw_content, byte_offset, new_offset, icao_code)
+                total_records += len(records)
+                if total_records > MAX_RECORDS_PER_REQUEST:
+                    results.append({"fileName": file.filename, "error": f"Limite de {MAX_RECORDS_PER_REQUEST} registros por requisição excedido."})
+                    break
+                new_records = records_to_dicts(records)
+                doc_ids = [f'{offset:012d}' for offset in line_offsets]
+                checkpoint_update = {
+                    'byteOffset': new_offset, 'prefixSha1': content_fingerprint(raw_content, new_offset),
+                    'updatedAt': firestore.SERVER_TIMESTAMP
+                }
+
+                if upload_doc:
+                    upload_ref = upload_doc.reference
+                    upload_data = upload_doc.to_dict()
+                    batch = db.batch()
+                    if new_records:
+                        write_records(upload_ref, new_records, doc_ids)
+                        updates = {
+                            'recordCount': firestore.Increment(len(new_records)),
+                            'lastTimestamp': last_timestamp_of(new_records, upload_data.get('lastTimestamp')),
+                        }
+                        if not upload_data.get('dataDate') and data_date:
+                            updates['dataDate'] = data_date
+                        for day, count in compute_daily_counts(new_records).items():
+                            updates[firestore.Client.field_path('dailyCounts', day)] = firestore.Increment(count)
+                        batch.update(upload_ref, updates)
+                    batch.set(checkpoint_ref, checkpoint_update, merge=True)
+                    batch.commit()
+                    if new_records:
+                        summary_updates = {'recordCount': firestore.Increment(len(new_records))}
+                        if 'dataDate' in updates:
+                            summary_updates['dataDate'] = updates['dataDate']
+                        index_upload(user_id, icao_code, upload_ref.id, summary_updates)
+                        invalidate_report_snapshots(user_id, icao_code, updates.get('dataDate', upload_data.get('dataDate')))
+                elif new_records:
+                    # Os registros vão antes do documento do upload, que só
+                    # aparece no histórico junto com o checkpoint
+                    upload_ref = uploads_collection(icao_code).document()
+                    write_records(upload_ref, new_records, doc_ids)
+                    batch = db.batch()
+                    batch.set(upload_ref, {
+                        'userId': user_id, 'createdAt': firestore.SERVER_TIMESTAMP,
+                        'recordCount': len(new_records), 'icaoCode': icao_code,
+                        'dataDate': data_date, 'sourceFile': file.filename,
+                        'lastTimestamp': last_timestamp_of(new_records),
+                        'dailyCounts': compute_daily_counts(new_records)
+                    })
+                    batch.set(checkpoint_ref, dict(checkpoint_update, uploadId=upload_ref.id), merge=True)
+                    batch.commit()
+                    index_upload(user_id, icao_code, upload_ref.id, {
+                        'createdAt': firestore.SERVER_TIMESTAMP, 'recordCount': len(new_records),
+                        'icaoCode': icao_code, 'dataDate': data_date
+                    })
+                    invalidate_report_snapshots(user_id, icao_code, data_date)
+                else:
+                    results.append({"fileName": file.filename, "error": "Nenhuma linha completa com registro válido encontrada."})
+                    continue
+            finally:
+                unlock_append_checkpoint(checkpoint_ref)
+
+            results.append({
+                "fileName": file.filename, "uploadId": upload_ref.id, "newUpload": upload_doc is None,
+                "appended": len(new_records), "records": new_records
+            })
+
+        appended_total = sum(r.get("appended", 0) for r in results)
+        note_record_count(appended_total)
+        return jsonify({
+            "success": True, "results": results,
+            "message": f"{appended_total} registro(s) novo(s) anexado(s)."
+        }), 200
+    except Exception as e:
+        print(f"ERRO ao anexar registros: {e}")
+        return jsonify({"error": f"Erro interno ao anexar os dados: {str(e)}"}), 500
+# ^^^^^^ FIM DA ANEXAÇÃO INCREMENTAL ^^^^^^
+
 @app.route('/api/get_uploads', methods=['GET'])
 def get_uploads():
     user_id = None
@@ -249,18 +1271,54 @@ def get_uploads():
         user_id = decoded_token['uid']
     except Exception as e:
         return jsonify({"error": "Autenticação falhou"}), 401
+    icao_code = resolve_icao(request.args.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
     try:
-        uploads_ref = db.collection('flight_uploads')
-        query = uploads_ref.where('userId', '==', user_id).order_by('createdAt', direction=firestore.Query.DESCENDING)
+        page_size = min(int(request.args.get('page_size', HISTORY_PAGE_SIZE)), 500)
+        offset = int(request.args.get('page_token', 0))
+        since_str = request.args.get('since')
+        since = datetime.fromisoformat(since_str.replace('Z', '+00:00')) if since_str else None
+    except ValueError:
+        return jsonify({"error": "Parâmetros de paginação inválidos"}), 400
+    if page_size < 1 or offset < 0:
+        return jsonify({"error": "Parâmetros de paginação inválidos"}), 400
+    if since and since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)  # sem fuso, vale como UTC
+    try:
+        index_ref = upload_index_ref(user_id, icao_code)
+        index_doc = index_ref.get()
+        if not index_doc.exists:
+            ensure_upload_index(user_id, icao_code)
+            index_doc = index_ref.get()
+        index_data = index_doc.to_dict()
+        updated_at = index_data.get('updatedAt')
+
+        # "Mudou desde": o cliente mantém a lista que já tem se nada mudou
+        if since and updated_at:
+            if updated_at <= since:
+                return jsonify({"changed": False, "updatedAt": updated_at.isoformat()}), 200
+
+        summaries = sorted(
+            index_data.get('uploads', {}).items(),
+            key=lambda item: item[1].get('createdAt') or EPOCH,
+            reverse=True
+        )
+        page = summaries[offset:offset + page_size]
         results = []
-        for doc in query.stream():
-            doc_data = doc.to_dict()
+        for upload_id, summary in page:
+            created_at = summary.get('createdAt')
             results.append({
-                'uploadId': doc.id, 'createdAt': doc_data['createdAt'].isoformat(),
-                'recordCount': doc_data.get('recordCount'), 'icaoCode': doc_data.get('icaoCode', None),
-                'dataDate': doc_data.get('dataDate', None)
+                'uploadId': upload_id, 'createdAt': created_at.isoformat() if created_at else None,
+                'recordCount': summary.get('recordCount'), 'icaoCode': summary.get('icaoCode', None),
+                'dataDate': summary.get('dataDate', None)
             })
-        return jsonify(results), 200
+        next_offset = offset + page_size
+        return jsonify({
+            "changed": True, "uploads": results,
+            "updatedAt": updated_at.isoformat() if updated_at else None,
+            "nextPageToken": str(next_offset) if next_offset < len(summaries) else None
+        }), 200
     except Exception as e:
         print(f"ERRO ao buscar uploads: {e}")
         return jsonify({"error": "Não foi possível buscar o histórico de uploads."}), 500
@@ -274,12 +1332,16 @@ def get_records(upload_id):
         user_id = decoded_token['uid']
     except Exception as e:
         return jsonify({"error": "Autenticação falhou"}), 401
+    icao_code = resolve_icao(request.args.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
     try:
-        upload_doc = db.collection('flight_uploads').document(upload_id).get()
+        upload_ref = uploads_collection(icao_code).document(upload_id)
+        upload_doc = upload_ref.get()
         if not upload_doc.exists or upload_doc.to_dict()['userId'] != user_id:
             return jsonify({"error": "Acesso não autorizado ou upload não encontrado"}), 403
-        records_ref = db.collection('flight_uploads').document(upload_id).collection('records')
-        records = [doc.to_dict() for doc in records_ref.stream()]
+        records = stream_collection(upload_ref.collection('records'))
+        note_record_count(len(records))
         return jsonify(records), 200
     except Exception as e:
         print(f"ERRO ao buscar registros do upload {upload_id}: {e}")
@@ -313,8 +1375,11 @@ def delete_upload(upload_id):
         user_id = decoded_token['uid']
     except Exception as e:
         return jsonify({"error": "Autenticação falhou"}), 401
+    icao_code = resolve_icao(request.args.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
     try:
-        upload_ref = db.collection('flight_uploads').document(upload_id)
+        upload_ref = uploads_collection(icao_code).document(upload_id)
         upload_doc = upload_ref.get()
         if not upload_doc.exists:
             return jsonify({"error": "Upload não encontrado"}), 404
@@ -327,6 +1392,9 @@ def delete_upload(upload_id):
         print(f"Subcoleção 'records' apagada. Apagando documento principal...")
 
         upload_ref.delete()
+        delete_append_checkpoints(user_id, upload_id)
+        unindex_upload(user_id, icao_code, upload_id)
+        invalidate_report_snapshots(user_id, icao_code, upload_doc.to_dict().get('dataDate'))
         print(f"Documento {upload_id} apagado com sucesso.")
         
         return jsonify({"success": True, "message": "Registro apagado com sucesso!"}), 200
@@ -344,30 +1412,61 @@ def get_aggregated_data():
         user_id = decoded_token['uid']
     except Exception as e:
         return jsonify({"error": "Autenticação falhou"}), 401
+    icao_code = resolve_icao(request.args.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     if not start_date_str or not end_date_str:
         return jsonify({"error": "As datas de início e fim são obrigatórias"}), 400
     try:
-        start_date = datetime.fromisoformat(start_date_str + 'T00:00:00')
-        end_date = datetime.fromisoformat(end_date_str + 'T23:59:59')
-
-        uploads_ref = db.collection('flight_uploads')
-        start_iso = start_date.isoformat() + 'Z'
-        end_iso = end_date.isoformat() + 'Z'
-
-        query = uploads_ref.where('userId', '==', user_id).where('dataDate', '>=', start_iso).where('dataDate', '<=', end_iso)
-        
-        relevant_uploads = [doc.id for doc in query.stream()]
-        all_records = []
-        for upload_id in relevant_uploads:
-            records_ref = db.collection('flight_uploads').document(upload_id).collection('records')
-            records = [doc.to_dict() for doc in records_ref.stream()]
-            all_records.extend(records)
+        start_iso, end_iso = period_bounds(start_date_str, end_date_str)
+        all_records = load_records_in_period(user_id, icao_code, start_iso, end_iso)
+        note_record_count(len(all_records))
         return jsonify(all_records), 200
     except Exception as e:
         print(f"ERRO ao agregar dados: {e}")
         return jsonify({"error": "Não foi possível processar a solicitação."}), 500
 
+@app.route('/api/get_report', methods=['GET'])
+def get_report():
+    user_id = None
+    try:
+        auth_header = request.headers.get('Authorization')
+        id_token = auth_header.split(' ').pop()
+        decoded_token = auth.verify_id_token(id_token)
+        user_id = decoded_token['uid']
+    except Exception as e:
+        return jsonify({"error": "Autenticação falhou"}), 401
+    icao_code = resolve_icao(request.args.get('icao'))
+    if not icao_code:
+        return jsonify({"error": "Aeródromo não configurado"}), 400
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    if not start_date_str or not end_date_str:
+        return jsonify({"error": "As datas de início e fim são obrigatórias"}), 400
+    try:
+        start_iso, end_iso = period_bounds(start_date_str, end_date_str)
+        snapshot_ref = report_snapshot_ref(user_id, icao_code, start_date_str, end_date_str)
+        snapshot = snapshot_ref.get()
+        if snapshot.exists:
+            return jsonify(snapshot.to_dict()['report']), 200
+
+        index_ref = upload_index_ref(user_id, icao_code)
+        index_doc = index_ref.get()
+        generation = index_doc.to_dict().get('updatedAt') if index_doc.exists else None
+        records = load_records_in_period(user_id, icao_code, start_iso, end_iso)
+        note_record_count(len(records))
+        report = build_report(records, icao_code)
+        # Se um upload mudou durante o cálculo, responde sem guardar o snapshot
+        store_report_snapshot(db.transaction(), snapshot_ref, index_ref, generation, {
+            'userId': user_id, 'icaoCode': icao_code, 'startDate': start_iso, 'endDate': end_iso,
+            'createdAt': firestore.SERVER_TIMESTAMP, 'report': report
+        })
+        return jsonify(report), 200
+    except Exception as e:
+        print(f"ERRO ao gerar relatório: {e}")
+        return jsonify({"error": "Não foi possível gerar o relatório."}), 500
+
 if __name__ == '__main__':
     app.run(debug=True)
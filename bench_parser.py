@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Benchmark do caminho de upload: parse, gravação do staging e memória.
+
+A serialização é a mesma do /api/upload (staged_json_chunks, um registro por
+vez); o pico de memória cobre parse + staging de uma requisição.
+
+Uso: python bench_parser.py [numero_de_linhas]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+SAMPLE_LINES = [
+    "SBIZ{seq:05d}{date}AZU4567A320N   SBKP IV {hhmm} SBIZ 07 SBIZ",
+    "SBIZ{seq:05d}{date}FAB2345C95M    VV {hhmm} SBBE 25 SBIZ",
+    "SBIZ{seq:05d}{date}PTABC  C172 G  VV SBIZ {hhmm} SBMA",
+    "SBIZ{seq:05d}{date}PRXYZ  AT72S   IV {hhmm} SBGO 07 SBIZ",
+    "SBIZ{seq:05d}{date}PPQRS  B737 N  VV {hhmm}",
+]
+
+
+def build_content(n_lines, seed=42):
+    rnd = random.Random(seed)
+    lines = ["SBIZAIZ0 CABECALHO"]
+    for seq in range(n_lines):
+        template = rnd.choice(SAMPLE_LINES)
+        date = f"{rnd.randint(1, 28):02d}1025"
+        hhmm = f"{rnd.randint(0, 23):02d}{rnd.randint(0, 59):02d}"
+        lines.append(template.format(seq=seq, date=date, hhmm=hhmm))
+    return '\n'.join(lines)
+
+
+def main():
+    from app import parse_data_file, staged_json_chunks
+
+    n_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    content = build_content(n_lines)
+
+    start = time.perf_counter()
+    parsed = parse_data_file(content)
+    parse_time = time.perf_counter() - start
+
+    groups = [{"fileName": "bench.dat", "records": parsed["records"]}]
+    start = time.perf_counter()
+    with open(os.devnull, 'w', encoding='utf-8') as f:
+        staged_bytes = sum(f.write(chunk) for chunk in staged_json_chunks('bench', groups))
+    serialize_time = time.perf_counter() - start
+
+    # Memória retida pelos registros já parseados e pico da requisição inteira
+    tracemalloc.start()
+    parsed = parse_data_file(content)
+    retained, _ = tracemalloc.get_traced_memory()
+    with open(os.devnull, 'w', encoding='utf-8') as f:
+        f.writelines(staged_json_chunks('bench', [{"fileName": "bench.dat", "records": parsed["records"]}]))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n_records = len(parsed["records"])
+    print(f"Linhas: {n_lines} | Registros: {n_records}")
+    print(f"Parse:        {parse_time:.3f}s ({n_records / parse_time:,.0f} registros/s)")
+    print(f"Staging:      {serialize_time:.3f}s ({staged_bytes / 1e6:.1f} MB de JSON)")
+    print(f"Total:        {parse_time + serialize_time:.3f}s")
+    print(f"Memória:      {retained / max(n_records, 1):.0f} bytes/registro retidos, "
+          f"pico de {peak / 1e6:.1f} MB (parse + staging)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Configuração do gunicorn, lida automaticamente a partir do diretório do app.
+# Com SERVING_MODE=gevent cada worker atende várias requisições enquanto
+# espera o Firestore, em vez de ficar parado em cada ida e volta de rede.
+
+import os
+
+SERVING_MODE = os.environ.get('SERVING_MODE', 'sync')
+
+timeout = 120
+
+if SERVING_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '100'))
+else:
+    # Quem está na fila de ingestão ocupa um worker (ou thread) parado. Com
+    # os limites padrão do app (INGEST_CONCURRENCY=2, INGEST_QUEUE_SIZE=4),
+    # 2 workers x 4 threads deixam 2 livres para as consultas mesmo com a
+    # ingestão saturada.
+    workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+    threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+
+    # Mesmos padrões de app.py; lidos do ambiente para não importar o app
+    # (e inicializar o Firebase) no processo mestre.
+    ingest_slots = (int(os.environ.get('INGEST_CONCURRENCY', '2'))
+                    + int(os.environ.get('INGEST_QUEUE_SIZE', '4')))
+    if workers * threads <= ingest_slots:
+        print(f"AVISO: {workers} workers x {threads} threads não passam das "
+              f"{ingest_slots} vagas de ingestão (execução + fila); durante cargas "
+              f"em massa as consultas vão esperar. Aumente WEB_CONCURRENCY ou "
+              f"GUNICORN_THREADS, ou reduza INGEST_QUEUE_SIZE.")
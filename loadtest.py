@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Teste de carga das rotas de leitura com vários usuários simultâneos.
+
+Compara o modo sync com o modo gevent. Exemplo:
+
+    SERVING_MODE=sync   gunicorn -w 2 app:app
+    SERVING_MODE=gevent gunicorn -w 2 app:app
+
+    LOADTEST_TOKEN=<id token do Firebase> python loadtest.py \\
+        --url http://127.0.0.1:8000 --users 50 --duration 30 --workers 2 \\
+        --start-date 2025-10-01 --end-date 2025-10-31
+
+O resultado de interesse é o throughput por worker (req/s dividido por -w).
+"""
+
+import argparse
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+def build_paths(args):
+    paths = [f'/api/get_uploads?icao={args.icao}']
+    if args.start_date and args.end_date:
+        paths.append(f'/api/get_aggregated_data?start_date={args.start_date}'
+                     f'&end_date={args.end_date}&icao={args.icao}')
+    if args.upload_id:
+        paths.append(f'/api/get_records/{args.upload_id}?icao={args.icao}')
+    return paths
+
+
+def user_loop(base_url, token, paths, deadline, latencies, errors, lock):
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        req = urllib.request.Request(base_url + path, headers={'Authorization': 'Bearer ' + token})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                response.read()
+            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(path)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=1, help='número de workers do gunicorn (-w)')
+    parser.add_argument('--icao', default='SBIZ')
+    parser.add_argument('--start-date')
+    parser.add_argument('--end-date')
+    parser.add_argument('--upload-id')
+    args = parser.parse_args()
+
+    token = os.environ.get('LOADTEST_TOKEN', '')
+    paths = build_paths(args)
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    threads = [
+        threading.Thread(target=user_loop, args=(args.url, token, paths, deadline, latencies, errors, lock))
+        for _ in range(args.users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    throughput = len(latencies) / elapsed
+    print(f"Usuários: {args.users} | Duração: {elapsed:.1f}s | Rotas: {len(paths)}")
+    print(f"Requisições OK: {len(latencies)} | Erros: {len(errors)}")
+    print(f"Throughput: {throughput:.1f} req/s ({throughput / args.workers:.1f} req/s por worker)")
+    print(f"Latência p50: {percentile(latencies, 50) * 1000:.0f} ms | "
+          f"p95: {percentile(latencies, 95) * 1000:.0f} ms | p99: {percentile(latencies, 99) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
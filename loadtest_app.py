@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""Entrada do gunicorn para o teste de carga offline (loadtest_offline.py).
+
+Carrega o app.py trocando o Firestore e a autenticação do Firebase:
+
+    LOADTEST_BACKEND=memory   (padrão) Firestore em memória, dentro do worker.
+                              Use um único worker (-w 1), pois cada processo
+                              tem o seu próprio banco.
+    LOADTEST_BACKEND=emulator Emulador do Firestore em FIRESTORE_EMULATOR_HOST,
+                              compartilhado entre os workers.
+
+O token "Bearer <uid>" é aceito como o próprio uid do usuário.
+
+    FIREBASE_CREDENTIALS_JSON='{}' gunicorn -w 1 --threads 8 loadtest_app:app
+"""
+
+import copy
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+import app as app_module
+
+
+# vvvvvv FIRESTORE EM MEMÓRIA vvvvvv
+# Cobre apenas o que o app.py usa: coleções e subcoleções, where/order_by/
+# limit/stream, get/set(merge)/update/delete, lotes, transações (serializadas
+# pelo lock do banco) e os sentinelas SERVER_TIMESTAMP, Increment e
+# DELETE_FIELD.
+def resolve_value(value, current=None):
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, firestore.Increment):
+        return (current or 0) + value.value
+    if isinstance(value, dict):
+        current = current if isinstance(current, dict) else {}
+        return {key: resolve_value(item, current.get(key)) for key, item in value.items()
+                if item is not firestore.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def merge_into(target, data):
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_into(target[key], value)
+        else:
+            target[key] = resolve_value(value, target.get(key))
+
+
+def field_path_parts(key):
+    if '.' in key or '`' in key:
+        return FieldPath.from_api_repr(key).parts
+    return (key,)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self.exists else None
+
+
+class FakeDocument:
+    def __init__(self, db, collection_path, doc_id):
+        self._db = db
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    def _docs(self):
+        return self._db.collections.setdefault(self._collection_path, {})
+
+    def collection(self, name):
+        return FakeCollection(self._db, f'{self._collection_path}/{self.id}/{name}')
+
+    def get(self, transaction=None):
+        with self._db.lock:
+            return FakeSnapshot(self, copy.deepcopy(self._docs().get(self.id)))
+
+    def set(self, data, merge=False):
+        with self._db.lock:
+            docs = self._docs()
+            if merge and self.id in docs:
+                merge_into(docs[self.id], data)
+            else:
+                docs[self.id] = resolve_value(data)
+
+    def update(self, updates):
+        with self._db.lock:
+            docs = self._docs()
+            if self.id not in docs:
+                raise KeyError(f'Documento inexistente: {self._collection_path}/{self.id}')
+            for key, value in updates.items():
+                *parents, leaf = field_path_parts(key)
+                target = docs[self.id]
+                for part in parents:
+                    target = target.setdefault(part, {})
+                if value is firestore.DELETE_FIELD:
+                    target.pop(leaf, None)
+                else:
+                    target[leaf] = resolve_value(value, target.get(leaf))
+
+    def delete(self):
+        with self._db.lock:
+            self._docs().pop(self.id, None)
+
+
+class FakeQuery:
+    OPERATORS = {
+        '==': lambda a, b: a == b,
+        '>=': lambda a, b: a is not None and a >= b,
+        '<=': lambda a, b: a is not None and a <= b,
+        '>': lambda a, b: a is not None and a > b,
+        '<': lambda a, b: a is not None and a < b,
+    }
+
+    def __init__(self, db, path, filters=(), order=None, max_results=None):
+        self._db = db
+        self._path = path
+        self._filters = filters
+        self._order = order
+        self._limit = max_results
+
+    def where(self, field, op, value):
+        return FakeQuery(self._db, self._path, self._filters + ((field, op, value),), self._order, self._limit)
+
+    def order_by(self, field, direction=firestore.Query.ASCENDING):
+        return FakeQuery(self._db, self._path, self._filters, (field, direction), self._limit)
+
+    def limit(self, count):
+        return FakeQuery(self._db, self._path, self._filters, self._order, count)
+
+    def stream(self, transaction=None):
+        with self._db.lock:
+            items = [(doc_id, copy.deepcopy(data)) for doc_id, data in self._db.collections.get(self._path, {}).items()
+                     if all(self.OPERATORS[op](data.get(field), value) for field, op, value in self._filters)]
+        if self._order:
+            field, direction = self._order
+            items = [item for item in items if item[1].get(field) is not None]
+            items.sort(key=lambda item: item[1][field], reverse=direction == firestore.Query.DESCENDING)
+        if self._limit is not None:
+            items = items[:self._limit]
+        return iter([FakeSnapshot(FakeDocument(self._db, self._path, doc_id), data) for doc_id, data in items])
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._db, self._path, doc_id or uuid.uuid4().hex[:20])
+
+
+class FakeBatch:
+    def __init__(self):
+        self._operations = []
+
+    def set(self, reference, data, merge=False):
+        self._operations.append(lambda: reference.set(data, merge=merge))
+
+    def update(self, reference, updates):
+        self._operations.append(lambda: reference.update(updates))
+
+    def delete(self, reference):
+        self._operations.append(reference.delete)
+
+    def commit(self):
+        for operation in self._operations:
+            operation()
+        self._operations = []
+
+
+class FakeTransaction:
+    """Atende o @firestore.transactional: o lock fica preso do _begin ao
+    _commit/_rollback e as escritas só são aplicadas no commit."""
+
+    def __init__(self, db):
+        self._db = db
+        self._id = None
+        self._read_only = False
+        self._max_attempts = 1
+        self._operations = []
+
+    def _clean_up(self):
+        self._operations = []
+
+    def _begin(self, retry_id=None):
+        self._db.lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _end(self):
+        self._operations = []
+        if self._id is not None:
+            self._id = None
+            self._db.lock.release()
+
+    def _commit(self):
+        try:
+            for operation in self._operations:
+                operation()
+        finally:
+            self._end()
+
+    def _rollback(self):
+        self._end()
+
+    def set(self, reference, data, merge=False):
+        self._operations.append(lambda: reference.set(data, merge=merge))
+
+    def update(self, reference, updates):
+        self._operations.append(lambda: reference.update(updates))
+
+    def delete(self, reference):
+        self._operations.append(reference.delete)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.collections = {}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch()
+
+    def transaction(self):
+        return FakeTransaction(self)
+# ^^^^^^ FIM DO FIRESTORE EM MEMÓRIA ^^^^^^
+
+
+class StubAuth:
+    """Aceita qualquer token; o próprio token é o uid do usuário."""
+
+    @staticmethod
+    def verify_id_token(id_token):
+        return {'uid': id_token or 'loadtest-user'}
+
+
+LOADTEST_BACKEND = os.environ.get('LOADTEST_BACKEND', 'memory')
+if LOADTEST_BACKEND == 'emulator':
+    from google.cloud import firestore as cloud_firestore
+    app_module.db = cloud_firestore.Client(project=os.environ.get('LOADTEST_PROJECT', 'demo-loadtest'))
+else:
+    app_module.db = FakeFirestore()
+app_module.auth = StubAuth()
+
+app = app_module.app
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""Teste de carga ponta a ponta, offline, com baseline de desempenho.
+
+Para cada tamanho de dataset, sobe o app no gunicorn (loadtest_app:app,
+com Firestore em memória ou no emulador e autenticação simulada), popula
+uploads sintéticos do SBIZ pela própria API e reproduz uma mistura de
+upload, save, histórico, get_records, agregação e delete com vários
+usuários simultâneos. Reporta throughput, latência por rota (p50/p90/p95/
+p99) e memória (RSS) dos workers.
+
+    python loadtest_offline.py --sizes 1000 10000 50000 --save-baseline
+    python loadtest_offline.py --sizes 1000 10000 50000 --check
+
+Com --check, o resultado é comparado ao baseline salvo e o script sai com
+código 1 se o throughput cair, a latência p95 subir além da tolerância ou
+houver mais erros que no baseline. Só é possível comparar com um baseline
+gravado com a mesma configuração de carga (código 2 caso contrário).
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from bench_parser import build_content
+from loadtest import percentile
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'loadtest_baseline.json')
+PERIOD = ('2025-10-01', '2025-10-31')
+
+# Parâmetros que precisam ser iguais aos do baseline para a comparação valer
+COMPARABLE_CONFIG = ('users', 'duration', 'threads', 'workers', 'accounts', 'uploads_per_user', 'backend')
+
+# Peso de cada operação na mistura (upload já inclui o save do staging)
+OPERATION_WEIGHTS = {
+    'history': 30,
+    'get_records': 20,
+    'aggregate': 20,
+    'upload_save': 15,
+    'delete': 5,
+    'report': 10,
+}
+
+
+class Client:
+    def __init__(self, base_url, user_id):
+        self.base_url = base_url
+        self.user_id = user_id
+
+    def request(self, method, path, body=None, content_type=None):
+        headers = {'Authorization': 'Bearer ' + self.user_id}
+        if content_type:
+            headers['Content-Type'] = content_type
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                return response.status, json.loads(response.read() or b'null')
+        except urllib.error.HTTPError as e:
+            return e.code, None
+        except (urllib.error.URLError, http.client.HTTPException, OSError):
+            # Conexão recusada/resetada ou timeout: conta como erro da rota
+            return None, None
+
+    def upload(self, file_name, content):
+        boundary = uuid.uuid4().hex
+        body = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="icao"\r\n\r\nSBIZ\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="dataFiles"; filename="{file_name}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        ).encode() + content.encode() + f'\r\n--{boundary}--\r\n'.encode()
+        return self.request('POST', '/api/upload', body, f'multipart/form-data; boundary={boundary}')
+
+    def save(self, staging_id):
+        body = json.dumps({'staging_id': staging_id}).encode()
+        return self.request('POST', '/api/save_records', body, 'application/json')
+
+
+class LoadRun:
+    def __init__(self, base_url, size, accounts):
+        self.base_url = base_url
+        self.size = size
+        self.accounts = accounts
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.rejected = 0
+        self.seeded_uploads = {}
+
+    def record(self, operation, elapsed, status):
+        with self.lock:
+            if status == 429:
+                self.rejected += 1
+            elif status and status < 400:
+                self.latencies.setdefault(operation, []).append(elapsed)
+            else:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def timed(self, operation, func, *args):
+        start = time.perf_counter()
+        status, data = func(*args)
+        self.record(operation, time.perf_counter() - start, status)
+        return status, data
+
+    def upload_and_save(self, client, seed):
+        content = build_content(self.size, seed=seed)
+        status, data = self.timed('upload', client.upload, f'SBIZ_{seed}.dat', content)
+        if status != 200:
+            return
+        self.timed('save', client.save, data['staging_id'])
+
+    def seed(self, uploads_per_user):
+        for account in range(self.accounts):
+            client = Client(self.base_url, f'loadtest-user-{account}')
+            for i in range(uploads_per_user):
+                self.upload_and_save(client, seed=account * 1000 + i)
+            _, history = client.request('GET', '/api/get_uploads?icao=SBIZ&page_size=500')
+            self.seeded_uploads[client.user_id] = {upload['uploadId'] for upload in (history or {}).get('uploads', [])}
+        # As medições do seed não entram no resultado
+        self.latencies, self.errors, self.rejected = {}, {}, 0
+
+    def user_loop(self, user_index, deadline, rnd):
+        client = Client(self.base_url, f'loadtest-user-{user_index % self.accounts}')
+        operations, weights = zip(*OPERATION_WEIGHTS.items())
+        seeded = self.seeded_uploads.get(client.user_id, set())
+        while time.perf_counter() < deadline:
+            operation = rnd.choices(operations, weights)[0]
+            if operation == 'history':
+                self.timed('history', client.request, 'GET', '/api/get_uploads?icao=SBIZ')
+            elif operation == 'get_records' and seeded:
+                upload_id = rnd.choice(sorted(seeded))
+                self.timed('get_records', client.request, 'GET', f'/api/get_records/{upload_id}?icao=SBIZ')
+            elif operation == 'aggregate':
+                self.timed('aggregate', client.request, 'GET',
+                           f'/api/get_aggregated_data?start_date={PERIOD[0]}&end_date={PERIOD[1]}&icao=SBIZ')
+            elif operation == 'report':
+                self.timed('report', client.request, 'GET',
+                           f'/api/get_report?start_date={PERIOD[0]}&end_date={PERIOD[1]}&icao=SBIZ')
+            elif operation == 'upload_save':
+                self.upload_and_save(client, seed=rnd.randint(10 ** 6, 10 ** 7))
+            elif operation == 'delete':
+                # Só apaga uploads criados durante o teste, para manter o dataset estável
+                _, history = client.request('GET', '/api/get_uploads?icao=SBIZ&page_size=500')
+                created = [u['uploadId'] for u in (history or {}).get('uploads', []) if u['uploadId'] not in seeded]
+                if created:
+                    self.timed('delete', client.request, 'DELETE', f'/api/delete_upload/{rnd.choice(created)}?icao=SBIZ')
+
+    def run(self, users, duration, seed=0):
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=self.user_loop, args=(i, deadline, random.Random(seed + i)))
+                   for i in range(users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def worker_pids(master_pid):
+    """PIDs filhos do master do gunicorn, lidos de /proc (Linux)."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return 0.0
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak_per_worker = 0.0
+        self.peak_total = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            values = [rss_mb(pid) for pid in worker_pids(self.master_pid)]
+            if values:
+                self.peak_per_worker = max(self.peak_per_worker, max(values))
+                self.peak_total = max(self.peak_total, sum(values))
+            self.stopped.wait(self.interval)
+
+
+def start_server(args, port, staging_dir):
+    env = dict(os.environ)
+    env.update({
+        # Credenciais inválidas: o app.py não conecta ao Firebase real
+        'FIREBASE_CREDENTIALS_JSON': '{}',
+        'LOADTEST_BACKEND': args.backend,
+        'STAGING_DIR': staging_dir,
+        'PROFILE_SAMPLE_RATE': '0',
+    })
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '--threads', str(args.threads),
+               '-b', f'127.0.0.1:{port}', 'loadtest_app:app']
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env,
+                               stdout=subprocess.DEVNULL if not args.verbose else None,
+                               stderr=subprocess.DEVNULL if not args.verbose else None)
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            with urllib.request.urlopen(base_url + '/', timeout=2):
+                return process, base_url
+        except (urllib.error.URLError, OSError):
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn encerrou antes de ficar pronto (use --verbose)')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn não respondeu a tempo')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_size(args, size):
+    with tempfile.TemporaryDirectory() as staging_dir:
+        process, base_url = start_server(args, free_port(), staging_dir)
+        try:
+            load = LoadRun(base_url, size, args.accounts)
+            load.seed(args.uploads_per_user)
+            sampler = MemorySampler(process.pid)
+            sampler.start()
+            elapsed = load.run(args.users, args.duration)
+            sampler.stopped.set()
+            sampler.join()
+        finally:
+            stop_server(process)
+
+    total = sum(len(values) for values in load.latencies.values())
+    return {
+        'throughput': total / elapsed,
+        'requests': total,
+        'errors': load.errors,
+        'rejected429': load.rejected,
+        'workerRssMb': round(sampler.peak_per_worker, 1),
+        'totalRssMb': round(sampler.peak_total, 1),
+        'routes': {
+            operation: {
+                'count': len(values),
+                'p50': percentile(values, 50), 'p90': percentile(values, 90),
+                'p95': percentile(values, 95), 'p99': percentile(values, 99),
+            }
+            for operation, values in sorted(load.latencies.items())
+        },
+    }
+
+
+def print_result(size, result):
+    print(f"\n== {size} linhas por upload ==")
+    print(f"Throughput: {result['throughput']:.1f} req/s | Requisições: {result['requests']} | "
+          f"Erros: {sum(result['errors'].values())} | 429: {result['rejected429']}")
+    print(f"Memória: pico de {result['workerRssMb']} MB por worker ({result['totalRssMb']} MB no total)")
+    print(f"{'rota':<12}{'n':>7}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for operation, stats in result['routes'].items():
+        print(f"{operation:<12}{stats['count']:>7}" + ''.join(
+            f"{stats[p] * 1000:>9.0f}" for p in ('p50', 'p90', 'p95', 'p99')))
+
+
+def compare_to_baseline(results, config, baseline, tolerance):
+    """Lista de regressões (texto) em relação ao baseline salvo.
+
+    Levanta ValueError se a configuração de carga difere da do baseline.
+    """
+    saved_config = baseline.get('config', {})
+    mismatches = [f"{key}={config.get(key)!r} (baseline: {saved_config.get(key)!r})"
+                  for key in COMPARABLE_CONFIG if config.get(key) != saved_config.get(key)]
+    if mismatches:
+        raise ValueError('configuração diferente da do baseline: ' + ', '.join(mismatches))
+
+    regressions = []
+    for size, result in results.items():
+        reference = baseline.get('results', {}).get(size)
+        if not reference:
+            continue
+        if sum(result['errors'].values()) > sum(reference['errors'].values()):
+            regressions.append(f"{size}: {sum(result['errors'].values())} erro(s) > "
+                               f"baseline {sum(reference['errors'].values())}")
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            regressions.append(f"{size}: throughput {result['throughput']:.1f} < baseline {reference['throughput']:.1f} req/s")
+        if result['workerRssMb'] > reference['workerRssMb'] * (1 + tolerance):
+            regressions.append(f"{size}: memória {result['workerRssMb']} > baseline {reference['workerRssMb']} MB")
+        for operation, stats in result['routes'].items():
+            reference_stats = reference['routes'].get(operation)
+            if reference_stats and stats['p95'] > reference_stats['p95'] * (1 + tolerance):
+                regressions.append(f"{size}/{operation}: p95 {stats['p95'] * 1000:.0f} ms > "
+                                   f"baseline {reference_stats['p95'] * 1000:.0f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='linhas por arquivo sintético em cada rodada')
+    parser.add_argument('--uploads-per-user', type=int, default=5)
+    parser.add_argument('--accounts', type=int, default=3)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--backend', choices=['memory', 'emulator'], default='memory')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--check', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.backend == 'memory' and args.workers > 1:
+        parser.error('o backend em memória é por processo; use --workers 1 ou --backend emulator')
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ('save_baseline', 'check', 'baseline', 'verbose')}
+    baseline = None
+    if args.check:
+        # Confere a configuração antes de gastar o tempo da rodada
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        try:
+            compare_to_baseline({}, config, baseline, args.tolerance)
+        except ValueError as e:
+            print(f"Não é possível comparar: {e}")
+            sys.exit(2)
+
+    results = {}
+    for size in args.sizes:
+        results[str(size)] = run_size(args, size)
+        print_result(size, results[str(size)])
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'config': config, 'results': results}, f, indent=2)
+        print(f"\nBaseline salvo em {args.baseline}")
+
+    if args.check:
+        regressions = compare_to_baseline(results, config, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressões de desempenho:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+        print("\nSem regressões em relação ao baseline.")
+
+
+if __name__ == '__main__':
+    main()
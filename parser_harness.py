@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Equivalência e regressão entre implementações de parse_data_file.
+
+Uma "engine" é indicada como arquivo.py[:funcao] (a função padrão é
+parse_data_file). O corpus dourado (parser_corpus.json) traz uma linha de
+exemplo para cada ramo do formato junto com o registro esperado (ou null
+quando a linha deve ser descartada).
+
+    python parser_harness.py check [engine]
+        Compara a engine (padrão: app.py) com o corpus dourado.
+
+    python parser_harness.py diff ENGINE_A ENGINE_B [arquivo.dat ...]
+        Compara duas engines registro a registro, nas linhas do corpus
+        ou nos arquivos de dados informados.
+
+    python parser_harness.py bench [ENGINE ...] [--lines N]
+        Relatório de throughput (linhas/s) de cada engine.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+
+from bench_parser import build_content
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(BASE_DIR, 'parser_corpus.json')
+DEFAULT_ENGINES = ['app.py', 'app250919.py', '250918app.py']
+
+
+def load_engine(spec):
+    """Importa a função de parse a partir de 'arquivo.py[:funcao]'."""
+    path, _, func_name = spec.partition(':')
+    module_name = '_engine_' + os.path.splitext(os.path.basename(path))[0]
+    module_spec = importlib.util.spec_from_file_location(module_name, os.path.join(BASE_DIR, path))
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return getattr(module, func_name or 'parse_data_file')
+
+
+def run_engine(parse, content):
+    """Executa a engine e devolve os registros como dicts."""
+    records = parse(content)["records"]
+    return [rec.to_dict() if hasattr(rec, 'to_dict') else rec for rec in records]
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def diff_records(expected, actual):
+    """Lista de (campo, esperado, obtido) para os campos divergentes."""
+    if expected is None or actual is None:
+        return [] if expected == actual else [('registro', expected, actual)]
+    fields = sorted(set(expected) | set(actual))
+    return [(field, expected.get(field), actual.get(field))
+            for field in fields if expected.get(field) != actual.get(field)]
+
+
+def check(engine_spec):
+    parse = load_engine(engine_spec)
+    failures = 0
+    for case in load_corpus():
+        records = run_engine(parse, case['line'])
+        actual = records[0] if records else None
+        differences = diff_records(case['expected'], actual)
+        if differences:
+            failures += 1
+            print(f"FALHA {case['name']}: {case['line']!r}")
+            for field, expected, got in differences:
+                print(f"    {field}: esperado {expected!r}, obtido {got!r}")
+    total = len(load_corpus())
+    print(f"{engine_spec}: {total - failures}/{total} casos do corpus conferem")
+    return failures == 0
+
+
+def diff(spec_a, spec_b, paths):
+    parse_a, parse_b = load_engine(spec_a), load_engine(spec_b)
+    if paths:
+        lines = []
+        for path in paths:
+            with open(path, encoding='utf-8', errors='ignore') as f:
+                lines.extend(f.read().split('\n'))
+    else:
+        lines = [case['line'] for case in load_corpus()]
+
+    divergent = 0
+    for number, line in enumerate(lines, start=1):
+        records_a, records_b = run_engine(parse_a, line), run_engine(parse_b, line)
+        rec_a = records_a[0] if records_a else None
+        rec_b = records_b[0] if records_b else None
+        differences = diff_records(rec_a, rec_b)
+        if differences:
+            divergent += 1
+            print(f"Linha {number}: {line.strip()!r}")
+            for field, value_a, value_b in differences:
+                print(f"    {field}: {spec_a}={value_a!r} | {spec_b}={value_b!r}")
+    print(f"{divergent} de {len(lines)} linha(s) divergente(s) entre {spec_a} e {spec_b}")
+    return divergent == 0
+
+
+def bench(engine_specs, n_lines):
+    content = build_content(n_lines)
+    print(f"Throughput com {n_lines} linhas sintéticas:")
+    for spec in engine_specs:
+        parse = load_engine(spec)
+        start = time.perf_counter()
+        records = run_engine(parse, content)
+        elapsed = time.perf_counter() - start
+        print(f"    {spec:<20} {n_lines / elapsed:>12,.0f} linhas/s  "
+              f"({len(records)} registros em {elapsed:.3f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check')
+    check_parser.add_argument('engine', nargs='?', default='app.py')
+    diff_parser = subparsers.add_parser('diff')
+    diff_parser.add_argument('engine_a')
+    diff_parser.add_argument('engine_b')
+    diff_parser.add_argument('files', nargs='*')
+    bench_parser = subparsers.add_parser('bench')
+    bench_parser.add_argument('engines', nargs='*', default=DEFAULT_ENGINES)
+    bench_parser.add_argument('--lines', type=int, default=50000)
+    args = parser.parse_args()
+
+    if args.command == 'check':
+        ok = check(args.engine)
+    elif args.command == 'diff':
+        ok = diff(args.engine_a, args.engine_b, args.files)
+    else:
+        bench(args.engines, args.lines)
+        ok = True
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()